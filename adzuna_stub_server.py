@@ -0,0 +1,103 @@
+#############################
+# Local stand-in for the Adzuna search API, replaying recorded result pages, so the async ingestion can be run and checked without network access or API keys.
+# Serves GET /v1/api/jobs/<country>/search/<page> from adzuna_recorded_pages/<country>_search_<page>.json. Pages past the last recorded one
+# come back with no results, as the real API does. Query parameters (app_id, app_key, results_per_page, what ...) are accepted and ignored.
+# The bundled pages are synthetic adverts (from salary_benchmark.synthetic_description) in the API's response format; real recorded pages
+# dropped into the directory with the same names are served the same way.
+#
+# Usage: python adzuna_stub_server.py [--port 8000] [--pages adzuna_recorded_pages] [--latency 0.05] [--repeat 1]
+#############################
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+recorded_pages_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'adzuna_recorded_pages')
+_search_path = re.compile(r'^/v1/api/jobs/(?P<country>[a-z]{2})/search/(?P<page>\d+)$')
+
+
+def load_recorded_pages(pages_dir=recorded_pages_dir):
+    '''
+    {(country, page): page JSON} for every recorded page in the directory.
+    '''
+    pages = {}
+    for name in os.listdir(pages_dir):
+        m = re.match(r'^([a-z]{2})_search_(\d+)\.json$', name)
+        if m:
+            with open(os.path.join(pages_dir, name), encoding='utf-8') as f:
+                pages[(m.group(1), int(m.group(2)))] = json.load(f)
+    return pages
+
+
+def make_handler(pages, latency=0.0, repeat=1):
+    '''
+    Request handler class serving the recorded pages. latency (seconds) is added to every response to stand in for the network.
+    With repeat > 1 the recorded pages are served again after the last one (page n+1 is page 1 again, ...), to make longer runs for load testing.
+    '''
+    last_page = {}
+    for country, page in pages:
+        last_page[country] = max(page, last_page.get(country, 0))
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'               # Keep-alive, so the client's pooled connections are reused
+
+        def do_GET(self):
+            m = _search_path.match(urlsplit(self.path).path)
+            if m is None:
+                self._send(404, {'exception': 'NOT_FOUND'})
+                return
+            country, page = m.group('country'), int(m.group('page'))
+            if country not in last_page:
+                self._send(400, {'exception': 'UNSUPPORTED_COUNTRY'})
+                return
+            if latency:
+                time.sleep(latency)
+            total = last_page[country] * repeat
+            if page < 1 or page > total:
+                body = {'results': [], 'count': 0}
+            else:
+                body = pages[(country, (page - 1) % last_page[country] + 1)]
+            self._send(200, body)
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve_in_thread(port=0, pages_dir=recorded_pages_dir, latency=0.0, repeat=1):
+    '''
+    Start the stub server in a background thread. Returns the server; its base URL is f'http://127.0.0.1:{server.server_address[1]}'.
+    Port 0 picks a free port. Call server.shutdown() to stop it.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(load_recorded_pages(pages_dir), latency, repeat))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded Adzuna search API pages.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pages', default=recorded_pages_dir, help='Directory of recorded <country>_search_<page>.json pages')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--repeat', type=int, default=1, help='Serve the recorded pages this many times over')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(load_recorded_pages(args.pages), args.latency, args.repeat))
+    print(f'Serving {args.pages} on http://127.0.0.1:{args.port}')
+    server.serve_forever()
@@ -0,0 +1,105 @@
+#############################
+# Cleaning of the Adzuna DESCRIPTION (and salary_raw) text before the salary regex code is run.
+# The patterns expect tidy text: a literal "£" rather than "&pound;"/"&#163;", no HTML tags or non-breaking spaces between "per" and "hour",
+# single spaces between words and plain "-" dashes in salary ranges.
+#############################
+
+import html
+import re
+import time
+
+
+# Inline tags are dropped without a space, so "<b>£</b>25,000" stays "£25,000". Other tags (block-level or unknown) and comments
+# become a space, so "<li>Pay</li><li>£10</li>" doesn't run words together. Only tag-shaped text is touched, so "x < y and £10 per hour > z" is kept.
+_inline_tags = re.compile(r'</?(?:a|abbr|b|big|em|font|i|mark|small|span|strong|sub|sup|u)\b[^<>]*>', re.IGNORECASE)
+_tags = re.compile(r'<!--.*?-->|<!?/?[A-Za-z][^<>]*>', re.DOTALL)
+_whitespace = re.compile(r'\s+')
+_gbp = re.compile(r'\bGBP\s?(?=\d)')                    # "GBP 25,000" -> "£25,000"
+
+# One translate() call maps every odd space, dash and pound sign variant. Zero width characters are dropped.
+_character_map = str.maketrans({'\u00a0': ' ',    # No-break space
+                                '\u2007': ' ',    # Figure space
+                                '\u2009': ' ',    # Thin space
+                                '\u202f': ' ',    # Narrow no-break space
+                                '\u200b': None,   # Zero width space
+                                '\u200c': None,   # Zero width non-joiner
+                                '\u200d': None,   # Zero width joiner
+                                '\u2060': None,   # Word joiner
+                                '\ufeff': None,   # Byte order mark
+                                '\u2010': '-',    # Hyphen
+                                '\u2011': '-',    # Non-breaking hyphen
+                                '\u2012': '-',    # Figure dash
+                                '\u2013': '-',    # En dash
+                                '\u2014': '-',    # Em dash
+                                '\u2015': '-',    # Horizontal bar
+                                '\u2212': '-',    # Minus sign
+                                '\ufe63': '-',    # Small hyphen-minus
+                                '\uff0d': '-',    # Fullwidth hyphen-minus
+                                '\u20a4': '£',    # Lira sign, often typed for "£"
+                                '\uffe1': '£'     # Fullwidth pound sign
+                                })
+
+
+def _strip_tags(text):
+    return _tags.sub(' ', _inline_tags.sub('', text))
+
+
+def clean_description(text):
+    '''
+    Clean one description: strip HTML tags, unescape HTML entities, turn pound sign variants into "£", NBSP and other odd spaces into a space and
+    Unicode dashes into "-", then collapse runs of whitespace into a single space.
+    Each step is skipped when the text can't need it (no "<", no "&", pure ASCII), so plain text only pays for the whitespace collapse.
+    '''
+    if '<' in text:
+        text = _strip_tags(text)
+    if '&' in text:
+        text = html.unescape(text)
+        if '&' in text and ';' in text:                 # Double escaped entities e.g. "&amp;pound;"
+            text = html.unescape(text)
+        if '<' in text:                                 # Escaped markup e.g. "&lt;p&gt;"
+            text = _strip_tags(text)
+    if not text.isascii():
+        if 'Â£' in text:                                # "£" encoded as UTF-8 and read as Latin-1
+            text = text.replace('Â£', '£')
+        text = text.translate(_character_map)
+    if 'GBP' in text:
+        text = _gbp.sub('£', text)
+    return _whitespace.sub(' ', text).strip()
+
+
+def clean_descriptions(descriptions, stats=None):
+    '''
+    Clean a batch of descriptions (a list, pandas Series or other sequence). Values that are not strings become None.
+    A pandas Series gives a Series with the same index, anything else a list.
+    Pass a dict as stats to add up descriptions, chars_in, chars_out and seconds; cleaning_throughput(stats) gives characters per second.
+    '''
+    started = time.perf_counter()
+    if stats is None:
+        cleaned = [clean_description(d) if isinstance(d, str) else None for d in descriptions]
+    else:
+        cleaned = []
+        chars_in = chars_out = 0
+        for d in descriptions:                          # One pass, so one-shot iterables (generators, Arrow iterators) are counted too
+            if isinstance(d, str):
+                chars_in += len(d)
+                d = clean_description(d)
+                chars_out += len(d)
+            else:
+                d = None
+            cleaned.append(d)
+        stats['seconds'] = stats.get('seconds', 0.0) + time.perf_counter() - started
+        stats['descriptions'] = stats.get('descriptions', 0) + len(cleaned)
+        stats['chars_in'] = stats.get('chars_in', 0) + chars_in
+        stats['chars_out'] = stats.get('chars_out', 0) + chars_out
+
+    if hasattr(descriptions, 'index') and hasattr(descriptions, 'to_numpy'):
+        import pandas as pd
+        return pd.Series(cleaned, index=descriptions.index, name=getattr(descriptions, 'name', None), dtype=object)
+    return cleaned
+
+
+def cleaning_throughput(stats):
+    '''
+    Input characters cleaned per second, from the stats dict filled in by clean_descriptions().
+    '''
+    return stats['chars_in'] / stats['seconds'] if stats.get('seconds') else 0.0
@@ -0,0 +1,289 @@
+#############################
+# Async ingestion of fresh adverts from the Adzuna search API (or anything serving the same pages, e.g. adzuna_stub_server.py).
+# Pages are fetched concurrently over a small pool of keep-alive connections with a rate limit, the description field is batched up and the
+# batches go to a process pool running the salary patterns, so the network and the cores are kept busy at the same time.
+# Bounded queues between the stages give backpressure: when the workers fall behind the fetchers wait instead of piling pages up in memory.
+# Results are written to Parquet batch by batch as they come back.
+#
+# Usage: python salary_api_ingestion.py <output parquet> [--base-url https://api.adzuna.com] [--country gb] [--app-id ID --app-key KEY]
+#        [--param what=nurse ...] [--results-per-page 50] [--max-pages N] [--concurrency 8] [--rate 4] [--workers N] [--batch-size 500] [--clean]
+#        [--stub]    (run against adzuna_stub_server.py replaying adzuna_recorded_pages/)
+#############################
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import ssl
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# As in salary_extraction_runner.py, the worker processes compile the patterns once when they import this module.
+from salary_columns import extract_salary_columns
+
+
+# Fields copied from every advert to the output, as dotted paths into the advert JSON. The output column is the path with "." replaced by "_".
+default_keep_fields = ('id', 'created', 'location.display_name', 'category.label')
+
+
+class HTTPError(Exception):
+    pass
+
+
+'''
+HTTP client.
+The standard library has no async HTTP client, so this is a minimal HTTP/1.1 GET client on asyncio streams: up to pool_size keep-alive
+connections to one host, a rate limit of rate requests per second (spread evenly, not in bursts), and retries with backoff on connection
+errors, timeouts, 429 and 5xx responses.
+'''
+class RateLimiter:
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+class PooledHTTPClient:
+
+    def __init__(self, base_url, pool_size=8, rate=None, timeout=30.0, retries=3):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.requests = 0
+        self._limiter = RateLimiter(rate)
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle = []
+
+    async def get_json(self, path, params=None):
+        target = self.prefix + path + ('?' + urlencode(params) if params else '')
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                await self._limiter.acquire()
+                connection = self._idle.pop() if self._idle else None
+                try:
+                    if connection is None:
+                        connection = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+                    status, body, keep_alive = await asyncio.wait_for(self._request(connection, target), self.timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                    if connection is not None:
+                        connection[1].close()
+                    if attempt == self.retries:
+                        raise HTTPError(f'GET {target} failed: {e!r}') from e
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    continue
+
+                self.requests += 1
+                if keep_alive:
+                    self._idle.append(connection)
+                else:
+                    connection[1].close()
+                if status == 200:
+                    return json.loads(body)
+                if (status == 429 or status >= 500) and attempt < self.retries:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    continue
+                raise HTTPError(f'GET {target} returned {status}: {body[:200]!r}')
+
+    async def _request(self, connection, target):
+        reader, writer = connection
+        writer.write((f'GET {target} HTTP/1.1\r\nHost: {self.host}\r\nAccept: application/json\r\n'
+                      f'Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)       # Server closed an idle keep-alive connection
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):     # Trailers
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), body, keep_alive
+
+    def close(self):
+        for reader, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+def _field(advert, path):
+    value = advert
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return None if value is None else str(value)
+
+
+def extract_batch(descriptions, annualised=True, clean=False):
+    '''
+    Run in a worker process: the salary columns of a batch of descriptions.
+    '''
+    return extract_salary_columns(pd.Series(descriptions, dtype=object), annualised=annualised, clean=clean)
+
+
+'''
+Pipeline.
+fetchers (concurrency tasks) -> pages queue -> batcher -> futures queue -> writer
+The fetchers take page numbers in turn and stop at the first page with no results (or after max_pages). The batcher cuts the adverts into
+batches of batch_size and submits them to the process pool. The futures queue holds at most queue_size batches in flight, and the writer writes
+them in submission order. A full queue blocks the stage before it, back up to the fetchers.
+'''
+async def ingest(base_url, output_path, country='gb', params=None, field='description', keep_fields=default_keep_fields, results_per_page=50,
+                 max_pages=None, concurrency=8, rate=None, workers=None, batch_size=500, queue_size=None, annualised=True, clean=False):
+    '''
+    Fetch every page of the search and write the salary columns of the adverts (plus keep_fields) to output_path.
+    The output goes to a temporary file that is renamed at the end, so a failed run never leaves a half-written file behind.
+    Returns a dict of pages, adverts, requests and seconds.
+    '''
+    workers = workers or os.cpu_count()
+    queue_size = queue_size or 2 * workers
+    loop = asyncio.get_running_loop()
+    client = PooledHTTPClient(base_url, pool_size=concurrency, rate=rate)
+    pages = asyncio.Queue(maxsize=queue_size)
+    futures = asyncio.Queue(maxsize=queue_size)
+    next_page = iter(range(1, max_pages + 1)) if max_pages else itertools.count(1)
+    finished = asyncio.Event()
+    counts = {'pages': 0, 'adverts': 0}
+    started = time.perf_counter()
+
+    async def fetch():
+        while not finished.is_set():
+            page = next(next_page, None)
+            if page is None:
+                return
+            data = await client.get_json(f'/v1/api/jobs/{country}/search/{page}', dict(params or {}, results_per_page=results_per_page))
+            results = data.get('results') or []
+            if not results:
+                finished.set()
+                return
+            counts['pages'] += 1
+            await pages.put(results)
+
+    async def fetch_all():
+        try:
+            await asyncio.gather(*(fetch() for _ in range(concurrency)))
+        finally:
+            await pages.put(None)
+
+    async def batch(pool):
+        adverts = []
+        while True:
+            results = await pages.get()
+            if results is not None:
+                adverts.extend(results)
+            while len(adverts) >= batch_size or (results is None and adverts):
+                chunk, adverts = adverts[:batch_size], adverts[batch_size:]
+                kept = {path.replace('.', '_'): [_field(a, path) for a in chunk] for path in keep_fields}
+                future = loop.run_in_executor(pool, extract_batch, [_field(a, field) for a in chunk], annualised, clean)
+                await futures.put((kept, future))
+            if results is None:
+                await futures.put(None)
+                return
+
+    async def write():
+        writer = None
+        try:
+            while True:
+                item = await futures.get()
+                if item is None:
+                    break
+                kept, future = item
+                columns = await future
+                for name in reversed(list(kept)):
+                    columns.insert(0, name, pd.Series(kept[name], dtype='string'))
+                table = pa.Table.from_pandas(columns, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                await asyncio.to_thread(writer.write_table, table.cast(writer.schema))
+                counts['adverts'] += len(columns)
+
+            if writer is None:                          # No adverts - still write an (empty) output file
+                columns = extract_batch([], annualised)
+                for path in reversed(keep_fields):
+                    columns.insert(0, path.replace('.', '_'), pd.Series([], dtype='string'))
+                writer = pq.ParquetWriter(tmp_path, pa.Table.from_pandas(columns, preserve_index=False).schema)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    tmp_path = output_path + '.tmp'
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            await asyncio.gather(fetch_all(), batch(pool), write())
+    finally:
+        client.close()
+    os.replace(tmp_path, output_path)
+    return dict(counts, requests=client.requests, seconds=time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch adverts from the Adzuna search API and extract their salary columns.')
+    parser.add_argument('output', help='Parquet file to write')
+    parser.add_argument('--base-url', default='https://api.adzuna.com')
+    parser.add_argument('--country', default='gb')
+    parser.add_argument('--app-id', default=os.environ.get('ADZUNA_APP_ID'), help='Default: $ADZUNA_APP_ID')
+    parser.add_argument('--app-key', default=os.environ.get('ADZUNA_APP_KEY'), help='Default: $ADZUNA_APP_KEY')
+    parser.add_argument('--param', nargs='*', default=[], help='Extra search parameters as key=value, e.g. what=nurse where=leeds')
+    parser.add_argument('--field', default='description', help='Advert field holding the description')
+    parser.add_argument('--keep', nargs='*', default=list(default_keep_fields), help='Advert fields (dotted paths) copied to the output')
+    parser.add_argument('--results-per-page', type=int, default=50)
+    parser.add_argument('--max-pages', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=8, help='Pages fetched at the same time (and pooled connections)')
+    parser.add_argument('--rate', type=float, default=None, help='Requests per second (default: no limit)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Descriptions sent to a worker at a time')
+    parser.add_argument('--queue-size', type=int, default=None, help='Batches allowed in flight (default: 2 per worker)')
+    parser.add_argument('--clean', action='store_true', help='Clean the descriptions (HTML, entities, odd spaces and dashes) before extraction')
+    parser.add_argument('--stub', action='store_true', help='Start adzuna_stub_server.py locally and fetch from it instead of --base-url')
+    args = parser.parse_args()
+
+    params = dict(p.split('=', 1) for p in args.param)
+    if args.app_id:
+        params.update(app_id=args.app_id, app_key=args.app_key)
+    base_url = args.base_url
+    if args.stub:
+        from adzuna_stub_server import serve_in_thread
+        server = serve_in_thread()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    summary = asyncio.run(ingest(base_url, args.output, args.country, params, args.field, args.keep, args.results_per_page, args.max_pages,
+                                 args.concurrency, args.rate, args.workers, args.batch_size, args.queue_size, clean=args.clean))
+    print(f"{summary['pages']} pages, {summary['adverts']} adverts, {summary['requests']} requests in {summary['seconds']:.1f}s")
@@ -0,0 +1,313 @@
+#############################
+# Benchmarks and regression checks for the salary patterns.
+# - A synthetic (so already anonymised) corpus of Adzuna-style descriptions with the expected extractions frozen in salary_regression_corpus.jsonl
+# - Per-pattern throughput (descriptions/sec and MB/sec) and per-description latency percentiles for each execution path
+# - Scaling curves across description length and worker count, and the time of each execution path on the pathological inputs
+# - A differential check that every execution path gives exactly the same hits as the reference regex strings
+# Results are written as JSON so runs can be compared.
+#
+# Usage: python salary_benchmark.py [--quick] [--output results.json] [--compare previous.json] [--rebuild-corpus]
+#############################
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import salary_regex_code_for_description_var as salary_re
+from salary_regex_code_for_description_var import extract_pay_frequencies, pay_freq_tuples_re
+from salary_regex_hardening import linear_time_patterns, re2
+
+
+corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'salary_regression_corpus.jsonl')
+
+
+'''
+Synthetic corpus.
+Descriptions are put together from generic job advert sentences, pay statements in the formats the patterns are written for (hourly, daily,
+weekly, annual, k notation, ranges, "competitive"/"negotiable", living and minimum wage, zero hours) and figures that must NOT be read as pay
+(turnover, bonuses, "£10 million"). Nothing comes from real adverts.
+'''
+_titles = ['Warehouse Operative', 'Care Assistant', 'Software Engineer', 'Delivery Driver', 'Registered Nurse', 'Chef de Partie', 'Teaching Assistant',
+           'Accountant', 'Electrician', 'Customer Service Advisor', 'Cleaner', 'Data Analyst', 'Supply Teacher', 'HGV Driver', 'Receptionist', 'Project Manager']
+_places = ['Leeds', 'Manchester', 'Glasgow', 'Cardiff', 'Bristol', 'Birmingham', 'Newcastle', 'Norwich', 'Belfast', 'London', 'Swansea', 'Aberdeen']
+_filler = ['We are looking for a {title} to join our friendly team in {place}.',
+           'Our client, a leading employer in {place}, is recruiting an experienced {title}.',
+           'Duties include working closely with the wider team and keeping accurate records.',
+           'You will have excellent communication skills and a flexible approach to work.',
+           'Full training will be provided and there are good opportunities for progression.',
+           'Benefits include 25 days holiday, a pension scheme and free parking on site.',
+           'The role is Monday to Friday with occasional weekend work.',
+           'Applicants must hold a full UK driving licence.',
+           'Please apply with an up to date CV. Only shortlisted candidates will be contacted.',
+           'This is a temporary role with the possibility of becoming permanent.',
+           'You must have the right to work in the UK.',
+           'Shifts are worked on a rota basis including nights and weekends.']
+_pay = ['£{h} per hour', '£{h} - £{h2} per hour', 'hourly rate of £{h}', 'Pay: £{h}/hr', '£{h}ph', 'up to £{h} an hour',
+        '£{d} per day', 'day rate £{d} - £{d2}', '£{d} per shift', 'daily rate of £{d}',
+        '£{w} per week', 'weekly pay of £{w}', '£{w} - £{w2} a week',
+        'salary £{a} - £{a2}', '£{a} per annum', 'salary of £{a}', '£{k}k - £{k2}k per annum', 'salary of {k}k-{k2}k', '£{k}-{k2}k', '£{k}k',
+        'competitive salary', 'salary negotiable', 'negotiable salary and benefits', 'paid above the National Living Wage', 'minimum wage',
+        'zero hour contract', 'hours not guaranteed', 'casual contract']
+_not_pay = ['The company has a turnover of £{m} million.', 'We have invested £{m}m in new equipment.', 'Includes a £{b} welcome bonus.',
+            'Projects worth £{m}bn are planned.', 'Refer a friend and earn £{b}.']
+
+
+def _figures(rng):
+    h = rng.choice(['{:.2f}'.format(rng.uniform(8.5, 30)), str(rng.randint(9, 25))])
+    d = rng.randint(60, 650)
+    w = rng.randint(250, 1250)
+    a = rng.randrange(18000, 120000, 500)
+    k = rng.randint(18, 90)
+    return {'h': h, 'h2': '{:.2f}'.format(float(h) + rng.choice([0.5, 1, 2.25])), 'd': d, 'd2': d + rng.choice([20, 50, 100]),
+            'w': w, 'w2': w + rng.choice([50, 100]), 'a': '{:,}'.format(a), 'a2': '{:,}'.format(a + rng.choice([2000, 5000, 10000])),
+            'k': k, 'k2': k + rng.choice([2, 5, 10]), 'm': rng.randint(2, 900), 'b': rng.choice([100, 250, 500, 1000])}
+
+
+def synthetic_description(rng):
+    sentences = [rng.choice(_filler) for _ in range(rng.randint(2, 14))]
+    sentences += [rng.choice(_pay).capitalize() + '.' for _ in range(rng.choice([0, 0, 1, 1, 1, 2, 3]))]
+    if rng.random() < 0.2:
+        sentences.append(rng.choice(_not_pay))
+    rng.shuffle(sentences)
+    values = dict(_figures(rng), title=rng.choice(_titles), place=rng.choice(_places))
+    return ' '.join(sentence.format(**values) for sentence in sentences)
+
+
+def reference_patterns():
+    '''
+    The patterns compiled afresh from the raw regex strings in salary_regex_code_for_description_var, for the differential checks.
+    '''
+    raw = {'vacancy_with_zero_hour_contracts': (salary_re.zero_hours, 0),
+           'vacancy_with_hourly_wage': (salary_re.hourly_wage, re.VERBOSE),
+           'vacancy_with_daily_wage': (salary_re.daily_wage, re.VERBOSE),
+           'vacancy_with_weekly_wage': (salary_re.weekly_wage, re.VERBOSE),
+           'vacancy_with_annual_wage': (salary_re.annual_wage, re.VERBOSE),
+           'vacancy_with_competitive_negotiable_salary': (salary_re.competitive_negotiable_salary, re.VERBOSE),
+           'vacancy_with_national_living_wage': (salary_re.nat_liv_wage, 0),
+           'vacancy_with_minimum_wage': (salary_re.min_wage, 0)}
+    return [(name, re.compile(*raw[name])) for name, pattern in pay_freq_tuples_re]
+
+
+def reference_extract(description, patterns):
+    return {name: [[list(m.groups()), m.start(), m.end()] for m in pattern.finditer(description)] for name, pattern in patterns}
+
+
+def build_corpus(size=500, seed=2021, path=corpus_path):
+    '''
+    Generate the synthetic corpus and freeze the reference extractions in it. Only needed when the corpus itself is meant to change.
+    '''
+    rng = random.Random(seed)
+    patterns = reference_patterns()
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for i in range(size):
+            description = synthetic_description(rng)
+            expected = {name: hits for name, hits in reference_extract(description, patterns).items() if hits}
+            f.write(json.dumps({'id': i, 'description': description, 'expected': expected}, ensure_ascii=False) + '\n')
+
+
+def load_corpus(path=corpus_path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+'''
+Execution paths. Each one takes a description and returns the same dict as extract_pay_frequencies().
+'''
+def execution_paths():
+    paths = {'reference': lambda d: extract_pay_frequencies(d, prefilter=False),
+             'prefilter': lambda d: extract_pay_frequencies(d),
+             'prefilter_windowed': lambda d: extract_pay_frequencies(d, windowed=True)}
+    if re2 is not None:
+        linear = linear_time_patterns()
+        paths['linear_time_windowed'] = lambda d: extract_pay_frequencies(d, linear, windowed=True)
+    return paths
+
+
+def _as_lists(result):
+    return {name: [[list(hit.groups), hit.start, hit.end] for hit in hits] for name, hits in result.items() if hits}
+
+
+def differential_check(corpus, paths=None):
+    '''
+    Compare every execution path with the frozen expectations and with the reference regex strings compiled afresh.
+    Returns {path name: [ids of descriptions that differ]} - all lists empty means every path is output-identical.
+    The pathological inputs from salary_regex_hardening are checked as well (with ids like "short_words/1000").
+    '''
+    from salary_regex_hardening import pathological_inputs
+
+    patterns = reference_patterns()
+    cases = [(row['id'], row['description'], row['expected']) for row in corpus]
+    cases += [(f'{family}/{size}', text, None) for family, size, text in pathological_inputs(sizes=(200, 2000))]
+    differences = {}
+    for path_name, extract in (paths or execution_paths()).items():
+        differences[path_name] = []
+        for case_id, description, expected in cases:
+            reference = {name: hits for name, hits in reference_extract(description, patterns).items() if hits}
+            found = _as_lists(extract(description))
+            if found != reference or (expected is not None and found != expected):
+                differences[path_name].append(case_id)
+    return differences
+
+
+'''
+Timing.
+'''
+def _percentiles(values, points=(50, 90, 99)):
+    ordered = sorted(values)
+    result = {f'p{p}': ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def pattern_throughput(descriptions, patterns=pay_freq_tuples_re, repeat=3):
+    '''
+    Descriptions/sec and MB/sec for every pattern run on its own over the whole corpus (best of repeat runs).
+    '''
+    megabytes = sum(len(d.encode('utf-8')) for d in descriptions) / 1e6
+    results = {}
+    for name, pattern in patterns:
+        best = min(_time_pattern(pattern, descriptions) for _ in range(repeat))
+        results[name] = {'descriptions_per_sec': len(descriptions) / best, 'mb_per_sec': megabytes / best}
+    return results
+
+
+def _time_pattern(pattern, descriptions):
+    start = time.perf_counter()
+    for description in descriptions:
+        for m in pattern.finditer(description):
+            pass
+    return time.perf_counter() - start
+
+
+def path_latency(descriptions, extract):
+    '''
+    Per-description latency percentiles (seconds) and overall throughput of one execution path.
+    '''
+    latencies = []
+    start = time.perf_counter()
+    for description in descriptions:
+        t = time.perf_counter()
+        extract(description)
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    megabytes = sum(len(d.encode('utf-8')) for d in descriptions) / 1e6
+    return dict(_percentiles(latencies), descriptions_per_sec=len(descriptions) / total, mb_per_sec=megabytes / total)
+
+
+def length_scaling(corpus_descriptions, lengths=(500, 2000, 8000, 32000), per_length=50, paths=None):
+    '''
+    Seconds per description for descriptions of each length, built by joining corpus descriptions.
+    '''
+    rng = random.Random(0)
+    results = {}
+    for length in lengths:
+        texts = []
+        for _ in range(per_length):
+            parts, size = [], 0
+            while size < length:
+                parts.append(rng.choice(corpus_descriptions))
+                size += len(parts[-1]) + 1
+            texts.append(' '.join(parts)[:length])
+        for path_name, extract in (paths or execution_paths()).items():
+            start = time.perf_counter()
+            for text in texts:
+                extract(text)
+            results.setdefault(path_name, {})[length] = (time.perf_counter() - start) / per_length
+    return results
+
+
+def pathological_latency(paths=None, size=64000):
+    '''
+    Seconds taken by each execution path on each family of salary_regex_hardening.pathological_inputs() at one size. The windowed paths
+    include the window search, so a window search that stops being linear shows up here.
+    '''
+    from salary_regex_hardening import pathological_inputs
+
+    results = {}
+    for family, size, text in pathological_inputs(sizes=(size,)):
+        for path_name, extract in (paths or execution_paths()).items():
+            start = time.perf_counter()
+            extract(text)
+            results.setdefault(path_name, {})[family] = time.perf_counter() - start
+    return results
+
+
+def _extract_batch(descriptions):
+    for description in descriptions:
+        extract_pay_frequencies(description)
+    return len(descriptions)
+
+
+def worker_scaling(descriptions, workers=(1, 2, 4, 8), copies=20, batch_size=250):
+    '''
+    Descriptions/sec of the default path (extract_pay_frequencies() with the prefilter, no windows) over a process pool of each size.
+    '''
+    work = descriptions * copies
+    batches = [work[i:i + batch_size] for i in range(0, len(work), batch_size)]
+    results = {}
+    for count in workers:
+        if count > (os.cpu_count() or 1) * 2:
+            continue
+        with ProcessPoolExecutor(max_workers=count) as pool:
+            list(pool.map(_extract_batch, batches[:count]))            # Start the workers before timing
+            start = time.perf_counter()
+            done = sum(pool.map(_extract_batch, batches))
+            results[count] = done / (time.perf_counter() - start)
+    return results
+
+
+def run_benchmarks(quick=False):
+    corpus = load_corpus()
+    descriptions = [row['description'] for row in corpus]
+    paths = execution_paths()
+    results = {'corpus_size': len(descriptions),
+               'corpus_mb': sum(len(d.encode('utf-8')) for d in descriptions) / 1e6,
+               'differences': differential_check(corpus, paths),
+               'pattern_throughput': pattern_throughput(descriptions, repeat=1 if quick else 3),
+               'path_latency': {name: path_latency(descriptions, extract) for name, extract in paths.items()},
+               'length_scaling': length_scaling(descriptions, lengths=(500, 4000) if quick else (500, 2000, 8000, 32000),
+                                                per_length=10 if quick else 50, paths=paths),
+               'pathological_latency': pathological_latency(paths, size=4000 if quick else 64000),
+               'worker_scaling': worker_scaling(descriptions, workers=(1, 2) if quick else (1, 2, 4, 8), copies=2 if quick else 20)}
+    return results
+
+
+def compare(results, previous, tolerance=0.1):
+    '''
+    Lines describing every throughput figure that dropped by more than tolerance (10%) against a previous run.
+    '''
+    lines = []
+    for section in ('pattern_throughput', 'path_latency'):
+        for name, figures in results[section].items():
+            before = previous.get(section, {}).get(name, {}).get('descriptions_per_sec')
+            now = figures['descriptions_per_sec']
+            if before and now < before * (1 - tolerance):
+                lines.append(f'{section} {name}: {before:,.0f} -> {now:,.0f} descriptions/sec ({now / before - 1:+.0%})')
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark and regression-check the salary patterns.')
+    parser.add_argument('--quick', action='store_true', help='Fewer repeats and smaller scaling runs')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--rebuild-corpus', action='store_true', help='Regenerate salary_regression_corpus.jsonl from the current patterns')
+    args = parser.parse_args()
+
+    if args.rebuild_corpus:
+        build_corpus()
+    results = run_benchmarks(args.quick)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for line in compare(results, json.load(f)):
+                print('SLOWER', line)
+    if any(results['differences'].values()):
+        raise SystemExit('Execution paths differ from the reference regex code: ' + json.dumps(results['differences']))
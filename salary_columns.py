@@ -0,0 +1,248 @@
+#############################
+# Batch extraction of salary columns from the Adzuna DESCRIPTION variable.
+# Takes a pandas Series (or an Arrow string array) of descriptions and returns compact typed columns instead of lists of match tuples.
+#############################
+
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:                                    # Arrow input is optional
+    pa = None
+
+from description_cleaning import clean_description
+from salary_regex_code_for_description_var import Hit, pay_freq_tuples_re, iter_pay_frequency_matches
+from salary_regex_hardening import DescriptionTimeout, time_budget
+from salary_result_cache import pattern_fingerprint
+
+
+'''
+Capture groups holding salary figures for each pay frequency.
+Each entry is (lower group, upper group, multiplier). The upper group is the second part of a salary range and is often missing.
+The "k" notation groups of annual_wage (Capture Groups 3 to 8) are multiplied by 1,000.
+'''
+pay_freq_amount_groups = {'vacancy_with_hourly_wage': [(1, 2, 1), (3, 4, 1)],
+                          'vacancy_with_daily_wage': [(1, 2, 1), (3, 4, 1)],
+                          'vacancy_with_weekly_wage': [(1, 2, 1), (3, 4, 1)],
+                          'vacancy_with_annual_wage': [(1, 2, 1), (3, 4, 1000), (5, 6, 1000), (7, 8, 1000)]
+                          }
+
+# Short names used for the amount columns and the categories of the dominant frequency column.
+pay_freq_names = {'vacancy_with_hourly_wage': 'hourly',
+                  'vacancy_with_daily_wage': 'daily',
+                  'vacancy_with_weekly_wage': 'weekly',
+                  'vacancy_with_annual_wage': 'annual'
+                  }
+
+
+'''
+Numeric normalisation.
+The captured figures are strings like "25,000", "10.50" or "45" (k notation). They are collected for the whole batch and converted with NumPy
+in one go: commas are stripped, the "k" multiplier is applied and the upper bound of a range is filled in from the lower bound when it is missing.
+Hourly, daily and weekly figures can then be annualised with configurable working hours, days and weeks.
+'''
+def figures_to_float(figures):
+    '''
+    Convert a sequence of captured figures (strings, None for a missing group) to a float64 array, with NaN for the missing ones.
+    '''
+    figures = np.asarray(figures, dtype=object)
+    missing = np.equal(figures, None)
+    figures[missing] = 'nan'
+    return np.char.replace(figures.astype(str), ',', '').astype(np.float64)
+
+
+def normalise_salary_range(lower, upper, multiplier=1):
+    '''
+    Turn the captured lower and upper figures of salary ranges into float64 arrays. multiplier is a scalar or an array (e.g. 1,000 for k notation).
+    A missing upper bound is filled with the lower bound, so a single figure becomes a range of one value.
+    '''
+    lower = figures_to_float(lower) * multiplier
+    upper = figures_to_float(upper) * multiplier
+    return lower, np.where(np.isnan(upper), lower, upper)
+
+
+def annual_multipliers(hours_per_week=37.5, days_per_week=5, weeks_per_year=52):
+    '''
+    Factors that turn hourly, daily, weekly and annual figures into annual salaries, keyed like pay_freq_amount_groups.
+    '''
+    return {'vacancy_with_hourly_wage': hours_per_week * weeks_per_year,
+            'vacancy_with_daily_wage': days_per_week * weeks_per_year,
+            'vacancy_with_weekly_wage': weeks_per_year,
+            'vacancy_with_annual_wage': 1
+            }
+
+
+def annualise(amounts, pay_freq_codes, hours_per_week=37.5, days_per_week=5, weeks_per_year=52):
+    '''
+    Annualise an array of amounts given the pay frequency code of each one (the position in pay_freq_amount_groups, -1 for unknown -> NaN).
+    '''
+    factors = np.array(list(annual_multipliers(hours_per_week, days_per_week, weeks_per_year).values()) + [np.nan])
+    return np.asarray(amounts, dtype=np.float64) * factors[pay_freq_codes]
+
+
+def _iter_descriptions(descriptions):
+    '''
+    Yield the descriptions one at a time. Arrow arrays are converted one chunk at a time so the whole column is never held as Python strings.
+    '''
+    if pa is not None and isinstance(descriptions, pa.ChunkedArray):
+        for chunk in descriptions.iterchunks():
+            yield from chunk.to_pylist()
+    elif pa is not None and isinstance(descriptions, pa.Array):
+        yield from descriptions.to_pylist()
+    else:
+        yield from descriptions
+
+
+def _scan_description(i, description, scanned, flags, figures, dominant, freq_codes):
+    '''
+    Record the hits of one description: set its flags, add its captured figures to figures and pick its dominant pay frequency.
+    '''
+    best_hits, best_start = 0, None
+    for name, matches in scanned:
+        groups = pay_freq_amount_groups.get(name)
+        hits, first_start = 0, None
+        for start, captured in matches:
+            hits += 1
+            if first_start is None:
+                first_start = start
+            if groups is None:
+                break                                   # Only the flag is needed for zero hours, competitive salary etc.
+            rows, lower_figures, upper_figures, multipliers = figures[name]
+            for lower_group, upper_group, multiplier in groups:
+                lower_figure, upper_figure = captured[lower_group - 1], captured[upper_group - 1]
+                if lower_figure is not None or upper_figure is not None:
+                    rows.append(i)
+                    lower_figures.append(lower_figure)
+                    upper_figures.append(upper_figure)
+                    multipliers.append(multiplier)
+        if not hits:
+            continue
+
+        flags[name][i] = True
+        if groups is not None and (hits > best_hits or (hits == best_hits and first_start < best_start)):
+            best_hits, best_start = hits, first_start
+            dominant[i] = freq_codes[name]
+
+
+def _scan_keeping_hits(description, patterns, prefilter, windowed, stats, hits):
+    '''
+    iter_pay_frequency_matches() for a cache miss: every hit is also kept in the hits dict, for the cache to store once the description is done.
+    '''
+    for name, matches in iter_pay_frequency_matches(description, patterns, prefilter=prefilter, windowed=windowed, stats=stats):
+        found = hits[name] = [Hit(m.groups(), m.start(), m.end()) for m in matches]
+        yield name, ((hit.start, hit.groups) for hit in found)
+
+
+def extract_salary_columns(descriptions, prefilter=True, windowed=False, annualised=False, hours_per_week=37.5, days_per_week=5, weeks_per_year=52,
+                           cache=None, patterns=pay_freq_tuples_re, budget=None, stats=None, clean=False):
+    '''
+    Extract typed salary columns from a batch of descriptions.
+
+    Returns one boolean column per pattern in pay_freq_tuples_re (named after its "vacancy_with_*" key), float32 "<freq>_wage_min" and
+    "<freq>_wage_max" columns for the hourly, daily, weekly and annual figures (NaN when there is no figure) and a categorical
+    "dominant_pay_freq" column holding the pay frequency with the most hits (ties go to the one found first in the description).
+    With annualised=True, float32 "annual_salary_min" and "annual_salary_max" columns hold the dominant frequency's figures annualised.
+    A pandas Series gives a DataFrame with the same index; an Arrow array gives a pyarrow Table with a dictionary-encoded dominant_pay_freq.
+    Results are written straight into preallocated NumPy arrays, so no match tuples are kept for the batch. The captured figures are only
+    kept as strings until the end of the batch and are then converted in bulk by normalise_salary_range().
+    Pass a salary_result_cache.SalaryResultCache as cache to look descriptions up in the cache before scanning them. The cache must have been
+    opened with the same patterns (linear_time_patterns() count as the same). Cache misses are scanned under the budget like everything else.
+    windowed=True runs the pound-anchored patterns on pound_windows() only. It is off by default: the window search costs more than it saves on
+    typical descriptions (see salary_benchmark.py), and only pays off on long descriptions with few "£" signs.
+    patterns can be swapped for e.g. salary_regex_hardening.linear_time_patterns(). With a budget (seconds per description), a description that
+    runs over it gets no hits and is flagged in a boolean "timed_out" column.
+    Pass a salary_extraction_stats.ExtractionStats as stats to time the patterns. Cache misses are timed like any other description; cache hits
+    are only counted, in stats.cache_hits. Descriptions that run over the budget are recorded with the time they ran for and counted in
+    stats.timeouts.
+    With clean=True each description goes through description_cleaning.clean_description() just before it is scanned, in the same pass.
+    '''
+    if cache is not None and pattern_fingerprint(patterns) != cache.fingerprint:
+        raise ValueError('The cache was opened with different patterns from the ones passed to extract_salary_columns()')
+
+    n = len(descriptions)
+    flags = {name: np.zeros(n, dtype=bool) for name, pattern in patterns}
+    dominant = np.full(n, -1, dtype=np.int8)
+    freq_codes = {name: code for code, name in enumerate(pay_freq_amount_groups)}
+    figures = {name: ([], [], [], []) for name in pay_freq_amount_groups}    # Row, lower figure, upper figure and multiplier of every captured range
+    timed_out = np.zeros(n, dtype=bool)
+
+    for i, description in enumerate(_iter_descriptions(descriptions)):
+        if clean and isinstance(description, str):
+            description = clean_description(description)
+        # The cache lookup happens here, outside the budget. A miss is only scanned (lazily, under the budget) and cached once it has finished.
+        cached = hits = None
+        if cache is not None and isinstance(description, str):
+            cached = cache.get(description)
+            if cached is None:
+                hits = {}
+            elif stats is not None:
+                stats.record_cache_hit()
+        if cached is not None:
+            scanned = ((name, ((hit.start, hit.groups) for hit in found)) for name, found in cached.items())
+        elif hits is not None:
+            scanned = _scan_keeping_hits(description, patterns, prefilter, windowed, stats, hits)
+        else:
+            scanned = ((name, ((m.start(), m.groups()) for m in matches))
+                       for name, matches in iter_pay_frequency_matches(description, patterns, prefilter=prefilter, windowed=windowed,
+                                                                        stats=stats))
+
+        if not budget:
+            _scan_description(i, description, scanned, flags, figures, dominant, freq_codes)
+            if hits is not None:
+                cache.put(description, hits)
+            continue
+
+        figure_counts = {name: len(rows) for name, (rows, *rest) in figures.items()}
+        started = perf_counter()
+        try:
+            with time_budget(budget):
+                _scan_description(i, description, scanned, flags, figures, dominant, freq_codes)
+        except DescriptionTimeout:
+            if stats is not None:
+                stats.record_timeout(description, perf_counter() - started)
+            # Drop whatever was found before the budget ran out
+            timed_out[i] = True
+            dominant[i] = -1
+            for flag in flags.values():
+                flag[i] = False
+            for name, count in figure_counts.items():
+                for values in figures[name]:
+                    del values[count:]
+            continue
+        if hits is not None:
+            cache.put(description, hits)
+
+    columns = dict(flags)
+    lower_by_freq, upper_by_freq = [], []
+    for name, (rows, lower_figures, upper_figures, multipliers) in figures.items():
+        lower, upper = np.full(n, np.nan, dtype=np.float32), np.full(n, np.nan, dtype=np.float32)
+        if rows:
+            rows = np.array(rows, dtype=np.intp)
+            low, high = normalise_salary_range(lower_figures, upper_figures, np.array(multipliers, dtype=np.float64))
+            np.fmin.at(lower, rows, np.fmin(low, high).astype(np.float32))
+            np.fmax.at(upper, rows, np.fmax(low, high).astype(np.float32))
+        columns[pay_freq_names[name] + '_wage_min'] = lower
+        columns[pay_freq_names[name] + '_wage_max'] = upper
+        lower_by_freq.append(lower)
+        upper_by_freq.append(upper)
+
+    if annualised:
+        rows = np.arange(n)
+        known = np.where(dominant < 0, 0, dominant)
+        for column, by_freq in (('annual_salary_min', lower_by_freq), ('annual_salary_max', upper_by_freq)):
+            amounts = np.stack(by_freq)[known, rows] if n else np.empty(0, dtype=np.float32)
+            columns[column] = annualise(amounts, dominant, hours_per_week, days_per_week, weeks_per_year).astype(np.float32)
+
+    if budget:
+        columns['timed_out'] = timed_out
+
+    categories = [pay_freq_names[name] for name in pay_freq_amount_groups]
+    if pa is not None and isinstance(descriptions, (pa.Array, pa.ChunkedArray)):
+        columns['dominant_pay_freq'] = pa.DictionaryArray.from_arrays(pa.array(dominant, mask=dominant < 0), pa.array(categories))
+        return pa.table(columns)
+
+    columns['dominant_pay_freq'] = pd.Categorical.from_codes(dominant, categories=categories)
+    return pd.DataFrame(columns, index=getattr(descriptions, 'index', None))
@@ -0,0 +1,269 @@
+#############################
+# Streaming salary statistics from the extracted salary columns.
+# Keeps, per group (e.g. region, sector and month) and pay frequency, a mergeable quantile sketch of the salaries plus counts of zero hour,
+# National Living Wage, minimum wage and competitive/negotiable salary adverts, so nothing but the sketches is held in memory.
+# States from parallel workers or monthly increments are merged without going back to the data, and saved as a small gzipped JSON file.
+# The inputs only hold dates (e.g. the API's "created" timestamp), so grouping by month needs --month-from: it turns that column into a
+# "month" column (YYYY-MM) and groups by it. Grouping by the raw timestamp would give a group per advert.
+#
+# Usage: python salary_distribution_aggregation.py <salary parquet dir or files ...> --state STATE [--group REGION CATEGORY] [--month-from created]
+#        [--merge OTHER_STATE ...] [--accuracy 0.01] [--summary summary.csv]
+#############################
+
+import argparse
+import gzip
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from salary_columns import pay_freq_names
+
+
+'''
+Quantile sketch.
+Values are counted in logarithmic buckets whose width is set by the relative accuracy (DDSketch): every quantile is returned within
+relative_accuracy of a true value in the data, whatever the distribution. Two sketches with the same accuracy merge exactly by adding bucket
+counts. max_bins caps the memory; if it is ever reached the lowest buckets are folded together, which only affects the lowest quantiles.
+'''
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}                                  # Bucket index -> count
+        self.zero_count = 0                             # Values <= 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        '''
+        Add an array of values. NaNs (no salary) are ignored.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+        self._collapse()
+
+    def _collapse(self):
+        if len(self.bins) <= self.max_bins:
+            return
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        self.bins[indexes[excess]] += sum(self.bins.pop(index) for index in indexes[:excess])
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f'Cannot merge sketches with relative accuracy {self.relative_accuracy} and {other.relative_accuracy}')
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._collapse()
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return min(0.0, self.max)
+        running = self.zero_count
+        for index in sorted(self.bins):
+            running += self.bins[index]
+            if running > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'max_bins': self.max_bins, 'bins': [[i, c] for i, c in sorted(self.bins.items())],
+                'zero_count': self.zero_count, 'count': self.count, 'sum': self.sum,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'], data['max_bins'])
+        sketch.bins = {i: c for i, c in data['bins']}
+        sketch.zero_count, sketch.count, sketch.sum = data['zero_count'], data['count'], data['sum']
+        if data['count']:
+            sketch.min, sketch.max = data['min'], data['max']
+        return sketch
+
+
+def to_month(dates):
+    '''
+    "YYYY-MM" of every value of a Series of datetimes or ISO date strings ("2021-03-04T12:00:00Z", "2021-03-04 12:00"). Anything else gives None.
+    '''
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        months = dates.dt.strftime('%Y-%m')
+    else:
+        months = dates.astype('string').str.extract(r'^(\d{4}-\d{2})', expand=False)
+    return months.astype(object).where(months.notna(), None)
+
+
+'''
+Aggregation by group.
+For every group the state holds the number of vacancies, the number of vacancies with each "vacancy_with_*" flag and one QuantileSketch per
+pay frequency of the middle of each vacancy's salary range (e.g. £10-£12 per hour counts as £11 per hour).
+With month_from (a date column, e.g. "created"), a "month" group column is derived from it with to_month() and added to the group columns.
+'''
+class SalaryAggregator:
+
+    def __init__(self, group_columns=(), relative_accuracy=0.01, max_bins=2048, month_from=None):
+        self.group_columns = list(group_columns)
+        self.month_from = month_from
+        if month_from and 'month' not in self.group_columns:
+            self.group_columns.append('month')
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.groups = {}
+
+    def _group(self, key):
+        state = self.groups.get(key)
+        if state is None:
+            state = self.groups[key] = {'vacancies': 0, 'flags': {},
+                                        'sketches': {freq: QuantileSketch(self.relative_accuracy, self.max_bins) for freq in pay_freq_names.values()}}
+        return state
+
+    def input_columns(self):
+        '''
+        Columns add() needs besides the salary columns: the group columns, with month_from in place of "month".
+        '''
+        if not self.month_from:
+            return list(self.group_columns)
+        return [c for c in self.group_columns if c != 'month'] + [self.month_from]
+
+    def add(self, columns):
+        '''
+        Add a chunk of extract_salary_columns() output (a DataFrame) holding the input_columns() as well.
+        '''
+        if self.month_from:
+            columns = columns.assign(month=to_month(columns[self.month_from]))
+        if self.group_columns:
+            grouped = columns.groupby(self.group_columns, dropna=False, sort=False, observed=True)
+        else:
+            grouped = [((), columns)]
+        flag_columns = [c for c in columns.columns if c.startswith('vacancy_with_')]
+
+        for key, frame in grouped:
+            key = tuple(None if pd.isna(value) else str(value) for value in (key if isinstance(key, tuple) else (key,)))
+            state = self._group(key)
+            state['vacancies'] += len(frame)
+            for flag, count in zip(flag_columns, frame[flag_columns].sum().tolist()):
+                state['flags'][flag] = state['flags'].get(flag, 0) + int(count)
+            for freq, sketch in state['sketches'].items():
+                lower = frame[freq + '_wage_min'].to_numpy(dtype=np.float64)
+                upper = frame[freq + '_wage_max'].to_numpy(dtype=np.float64)
+                sketch.add((lower + upper) / 2)
+
+    def merge(self, other):
+        if other.group_columns != self.group_columns or other.month_from != self.month_from:
+            raise ValueError(f'Cannot merge states grouped by {other.group_columns} (month from {other.month_from}) into states grouped by '
+                             f'{self.group_columns} (month from {self.month_from})')
+        for key, other_state in other.groups.items():
+            state = self._group(key)
+            state['vacancies'] += other_state['vacancies']
+            for flag, count in other_state['flags'].items():
+                state['flags'][flag] = state['flags'].get(flag, 0) + count
+            for freq, sketch in other_state['sketches'].items():
+                state['sketches'][freq].merge(sketch)
+        return self
+
+    def summary(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+        '''
+        DataFrame with one row per group and pay frequency: vacancies, number of salaries, mean, the quantiles and the share of vacancies
+        with each flag in the group.
+        '''
+        rows = []
+        for key, state in self.groups.items():
+            shares = {'share_' + flag[len('vacancy_with_'):]: count / state['vacancies'] if state['vacancies'] else math.nan
+                      for flag, count in state['flags'].items()}
+            for freq, sketch in state['sketches'].items():
+                row = dict(zip(self.group_columns, key), pay_freq=freq, vacancies=state['vacancies'], salaries=sketch.count,
+                           mean=sketch.sum / sketch.count if sketch.count else math.nan)
+                row.update({f'q{round(q * 100)}': sketch.quantile(q) for q in quantiles})
+                row.update(shares)
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def save(self, path):
+        state = {'group_columns': self.group_columns, 'month_from': self.month_from, 'relative_accuracy': self.relative_accuracy,
+                 'max_bins': self.max_bins,
+                 'groups': [{'key': list(key), 'vacancies': s['vacancies'], 'flags': s['flags'],
+                             'sketches': {freq: sketch.to_dict() for freq, sketch in s['sketches'].items()}}
+                            for key, s in self.groups.items()]}
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            state = json.load(f)
+        aggregator = cls(state['group_columns'], state['relative_accuracy'], state['max_bins'], state.get('month_from'))
+        for group in state['groups']:
+            aggregator.groups[tuple(group['key'])] = {'vacancies': group['vacancies'], 'flags': group['flags'],
+                                                      'sketches': {freq: QuantileSketch.from_dict(sketch) for freq, sketch in group['sketches'].items()}}
+        return aggregator
+
+
+def aggregate_files(paths, group_columns=(), relative_accuracy=0.01, batch_size=100000, aggregator=None, month_from=None):
+    '''
+    Stream the Parquet output of salary_extraction_runner.py (run with --keep for the group columns and the month_from column) into an
+    aggregator, batch by batch.
+    '''
+    import pyarrow.parquet as pq
+
+    aggregator = aggregator or SalaryAggregator(group_columns, relative_accuracy, month_from=month_from)
+    needed = aggregator.input_columns() + [c for freq in pay_freq_names.values() for c in (freq + '_wage_min', freq + '_wage_max')]
+    for path in paths:
+        parquet = pq.ParquetFile(path)
+        columns = needed + [c for c in parquet.schema_arrow.names if c.startswith('vacancy_with_')]
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+            aggregator.add(batch.to_pandas())
+    return aggregator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate extracted salaries into mergeable quantile sketches.')
+    parser.add_argument('inputs', nargs='*', help='Parquet files, or directories of them, written by salary_extraction_runner.py')
+    parser.add_argument('--state', required=True, help='State file to write (gzipped JSON)')
+    parser.add_argument('--group', nargs='*', default=[], help='Columns to group by, e.g. REGION CATEGORY')
+    parser.add_argument('--month-from', default=None, help='Date column (e.g. created) to derive a YYYY-MM "month" group column from')
+    parser.add_argument('--merge', nargs='*', default=[], help='Earlier state files to merge in')
+    parser.add_argument('--accuracy', type=float, default=0.01, help='Relative accuracy of the quantiles')
+    parser.add_argument('--summary', default=None, help='Also write the quantiles and shares to this CSV file')
+    args = parser.parse_args()
+
+    files = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.parquet'))
+        else:
+            files.append(path)
+    aggregator = aggregate_files(files, args.group, args.accuracy, month_from=args.month_from)
+    for state_path in args.merge:
+        aggregator.merge(SalaryAggregator.load(state_path))
+    aggregator.save(args.state)
+    if args.summary:
+        aggregator.summary().to_csv(args.summary, index=False)
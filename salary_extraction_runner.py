@@ -0,0 +1,188 @@
+#############################
+# Run the salary extraction over a directory of Adzuna dump shards (CSV, JSONL or Parquet) using every core.
+# Each input shard gives one Parquet output shard. Finished shards are recorded so a killed run picks up where it stopped.
+#
+# Usage: python salary_extraction_runner.py <input dir> <output dir> [--workers N] [--chunksize N] [--column DESCRIPTION] [--keep ID ...] [--cache FILE] [--budget SECONDS]
+#        [--stats FILE] [--clean]
+#############################
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Importing the extraction code compiles the patterns. Worker processes import this module once when they start,
+# so the patterns are compiled once per worker rather than once per shard or chunk.
+from salary_columns import extract_salary_columns
+from salary_extraction_stats import ExtractionStats
+from salary_result_cache import SalaryResultCache
+
+
+shard_suffixes = ('.csv', '.csv.gz', '.jsonl', '.jsonl.gz', '.parquet')
+completed_manifest = '_completed_shards.txt'
+
+
+def find_shards(input_dir):
+    '''
+    Input shards in the directory, largest first. Handing the big shards to the pool first stops one large shard from being left to run on its own at the end.
+    Shards that only differ in their suffix (e.g. x.csv and x.jsonl) would write the same output file, so they raise a ValueError.
+    '''
+    shards = [os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(shard_suffixes)]
+    by_output = {}
+    for shard in shards:
+        by_output.setdefault(output_path_for(shard, ''), []).append(os.path.basename(shard))
+    clashes = ['/'.join(sorted(names)) for names in by_output.values() if len(names) > 1]
+    if clashes:
+        raise ValueError(f'Shards with the same name but different suffixes would overwrite each other\'s output: {", ".join(sorted(clashes))}')
+    return sorted(shards, key=os.path.getsize, reverse=True)
+
+
+def output_path_for(shard, output_dir):
+    name = os.path.basename(shard)
+    for suffix in shard_suffixes:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return os.path.join(output_dir, name + '.salary.parquet')
+
+
+def read_completed(output_dir):
+    '''
+    Names of the shards already finished by an earlier run. A shard only counts as finished if its output file is still there.
+    '''
+    path = os.path.join(output_dir, completed_manifest)
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        names = {line.strip() for line in f if line.strip()}
+    return {name for name in names if os.path.exists(output_path_for(name, output_dir))}
+
+
+def mark_completed(output_dir, shard):
+    with open(os.path.join(output_dir, completed_manifest), 'a', encoding='utf-8') as f:
+        f.write(os.path.basename(shard) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_chunks(shard, column, keep_columns, chunksize):
+    '''
+    Yield DataFrames of at most chunksize rows holding the description column and the kept columns, so memory stays flat whatever the file size.
+    '''
+    columns = [column] + list(keep_columns)
+    if shard.endswith('.parquet'):
+        for batch in pq.ParquetFile(shard).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    if shard.endswith(('.jsonl', '.jsonl.gz')):
+        reader = pd.read_json(shard, lines=True, chunksize=chunksize, dtype=False)
+    else:
+        reader = pd.read_csv(shard, usecols=columns, dtype=str, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            chunk = chunk.reindex(columns=columns)
+            # Text formats don't fix the column types, so make the kept columns strings to give every chunk the same schema.
+            yield chunk.astype({c: 'string' for c in keep_columns})
+
+
+def extract_shard(shard, output_path, column='DESCRIPTION', keep_columns=(), chunksize=10000, annualised=True, cache_path=None, budget=None,
+                  with_stats=False, clean=False):
+    '''
+    Extract the salary columns of one shard chunk by chunk and write them to output_path. Returns the number of rows written and, with
+    with_stats, the ExtractionStats of the shard as a dict (None otherwise). With clean, descriptions are cleaned as they are extracted.
+    The output is written to a temporary file and renamed at the end, so a killed run never leaves a half-written shard behind.
+    With cache_path, results are looked up in (and added to) the SalaryResultCache at that path. With a budget, descriptions that take longer
+    than budget seconds are flagged in a "timed_out" column instead of stalling the worker.
+    '''
+    tmp_path = output_path + '.tmp'
+    writer = None
+    cache = SalaryResultCache(cache_path) if cache_path else None
+    stats = ExtractionStats() if with_stats else None
+    rows = 0
+    try:
+        for chunk in iter_chunks(shard, column, keep_columns, chunksize):
+            columns = extract_salary_columns(chunk[column].reset_index(drop=True), annualised=annualised, cache=cache, budget=budget,
+                                             stats=stats, clean=clean)
+            for c in keep_columns:
+                columns.insert(0, c, chunk[c].to_numpy())
+            table = pa.Table.from_pandas(columns, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(chunk)
+
+        if writer is None:                              # Empty shard - still write an (empty) output file
+            columns = extract_salary_columns(pd.Series([], dtype=object), annualised=annualised, budget=budget)
+            for c in keep_columns:
+                columns.insert(0, c, pd.Series([], dtype='string'))
+            writer = pq.ParquetWriter(tmp_path, pa.Table.from_pandas(columns, preserve_index=False).schema)
+    finally:
+        if writer is not None:
+            writer.close()
+        if cache is not None:
+            cache.close()
+
+    os.replace(tmp_path, output_path)
+    return rows, stats.to_dict() if stats is not None else None
+
+
+def run(input_dir, output_dir, column='DESCRIPTION', keep_columns=(), workers=None, chunksize=10000, annualised=True, cache_path=None, budget=None,
+        stats_path=None, clean=False):
+    '''
+    Extract every shard in input_dir that isn't already finished, using a pool of worker processes. Returns {shard name: rows written} for this run.
+    With stats_path, the ExtractionStats of all workers are merged and written there as JSON at the end of the run.
+    A shard that fails is reported straight away and the other shards carry on (and are recorded as finished). Once the pool is done a
+    RuntimeError lists the failed shards, so a rerun only has those left to do.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    done = read_completed(output_dir)
+    todo = [shard for shard in find_shards(input_dir) if os.path.basename(shard) not in done]
+    print(f'{len(done)} shards already done, {len(todo)} to go')
+
+    written = {}
+    failed = {}
+    stats = ExtractionStats() if stats_path else None
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(extract_shard, shard, output_path_for(shard, output_dir), column, tuple(keep_columns), chunksize, annualised,
+                               cache_path, budget, stats is not None, clean): shard
+                   for shard in todo}
+        for future in as_completed(futures):
+            shard = futures[future]
+            name = os.path.basename(shard)
+            try:
+                written[name], shard_stats = future.result()
+            except Exception as e:
+                failed[name] = e
+                print(f'{name}: failed - {e!r}')
+                continue
+            if shard_stats is not None:
+                stats.merge(shard_stats)
+            mark_completed(output_dir, shard)
+            print(f'{name}: {written[name]} rows')
+    if stats is not None:
+        stats.to_json(stats_path)
+    if failed:
+        failures = ', '.join(f'{name} ({e!r})' for name, e in failed.items())
+        raise RuntimeError(f'{len(failed)} of {len(todo)} shards failed: {failures}') from next(iter(failed.values()))
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract salary columns from a directory of Adzuna dump shards.')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--column', default='DESCRIPTION', help='Column holding the vacancy description')
+    parser.add_argument('--keep', nargs='*', default=[], help='Columns copied to the output as they are, e.g. the vacancy ID')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--chunksize', type=int, default=10000, help='Descriptions read at a time per worker')
+    parser.add_argument('--cache', default=None, help='SQLite file used to cache results between runs')
+    parser.add_argument('--budget', type=float, default=None, help='Seconds allowed per description before it is marked as timed out')
+    parser.add_argument('--stats', default=None, help='Write per-pattern timings and the slowest descriptions to this JSON file')
+    parser.add_argument('--clean', action='store_true', help='Clean the descriptions (HTML, entities, odd spaces and dashes) before extraction')
+    args = parser.parse_args()
+    run(args.input_dir, args.output_dir, args.column, args.keep, args.workers, args.chunksize, cache_path=args.cache, budget=args.budget,
+        stats_path=args.stats, clean=args.clean)
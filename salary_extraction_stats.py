@@ -0,0 +1,141 @@
+#############################
+# Opt-in instrumentation for the salary extraction.
+# Pass an ExtractionStats as stats to extract_pay_frequencies(), iter_pay_frequency_matches() or extract_salary_columns() to collect, per pattern,
+# the time spent, call and skip counts and match and hit rates, plus a histogram of time per description and the slowest descriptions.
+# Stats from several worker processes (or runs) are combined with merge(), and written out with to_json().
+#############################
+
+import hashlib
+import heapq
+import json
+
+
+# Upper edges (seconds) of the time-per-description histogram buckets. The last bucket holds everything slower.
+histogram_edges = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0)
+
+_empty_pattern_counts = {'calls': 0, 'skipped': 0, 'timeouts': 0, 'seconds': 0.0, 'matches': 0, 'hits': 0}
+
+
+class ExtractionStats:
+    '''
+    Per-pattern and per-description timings for an extraction run.
+
+    patterns maps each pattern name to its calls (descriptions the pattern ran on), skipped (descriptions the prefilter skipped), seconds,
+    matches (total matches) and hits (descriptions with at least one match). slowest keeps the top_n slowest descriptions as
+    (seconds, sha1 of the text, length) so no advert text ends up in the stats file.
+    cache_hits counts descriptions served from a SalaryResultCache. They are not scanned, so they are left out of descriptions, the timings and
+    the hit rates, which all describe the descriptions that were actually scanned.
+    timeouts counts descriptions that ran over a time budget. They are recorded like any other description (with the time they took until
+    they were stopped), and the pattern that was running when the budget ran out gets the time and a timeout in its own timeouts count.
+    '''
+
+    def __init__(self, top_n=20):
+        self.top_n = top_n
+        self.patterns = {}
+        self.descriptions = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(histogram_edges) + 1)
+        self.slowest = []                                     # Min-heap, so the fastest of the slowest is dropped first
+
+    def _pattern(self, name):
+        counts = self.patterns.get(name)
+        if counts is None:
+            counts = self.patterns[name] = dict(_empty_pattern_counts)
+        return counts
+
+    def record_pattern(self, name, seconds, matches):
+        counts = self._pattern(name)
+        counts['calls'] += 1
+        counts['seconds'] += seconds
+        counts['matches'] += matches
+        counts['hits'] += matches > 0
+
+    def record_skip(self, name):
+        self._pattern(name)['skipped'] += 1
+
+    def record_pattern_timeout(self, name, seconds):
+        counts = self._pattern(name)
+        counts['timeouts'] += 1
+        counts['seconds'] += seconds
+
+    def record_cache_hit(self):
+        self.cache_hits += 1
+
+    def record_timeout(self, description, seconds):
+        self.timeouts += 1
+        self.record_description(description, seconds)
+
+    def record_description(self, description, seconds):
+        self.descriptions += 1
+        self.seconds += seconds
+        bucket = 0
+        while bucket < len(histogram_edges) and seconds > histogram_edges[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+        if len(self.slowest) < self.top_n or seconds > self.slowest[0][0]:
+            entry = (seconds, hashlib.sha1(description.encode('utf-8')).hexdigest(), len(description))
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other):
+        '''
+        Add the counts of another ExtractionStats (or its to_dict() output, e.g. sent back from a worker process) to this one.
+        '''
+        if isinstance(other, dict):
+            other = ExtractionStats.from_dict(other)
+        for name, counts in other.patterns.items():
+            mine = self._pattern(name)
+            for key, value in counts.items():
+                mine[key] += value
+        self.descriptions += other.descriptions
+        self.cache_hits += other.cache_hits
+        self.timeouts += other.timeouts
+        self.seconds += other.seconds
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.slowest = heapq.nlargest(self.top_n, self.slowest + other.slowest)
+        heapq.heapify(self.slowest)
+        return self
+
+    def to_dict(self):
+        patterns = {}
+        for name, counts in self.patterns.items():
+            patterns[name] = dict(counts,
+                                  mean_seconds=counts['seconds'] / counts['calls'] if counts['calls'] else 0.0,
+                                  match_rate=counts['matches'] / counts['calls'] if counts['calls'] else 0.0,
+                                  hit_rate=counts['hits'] / self.descriptions if self.descriptions else 0.0,
+                                  share_of_time=counts['seconds'] / self.seconds if self.seconds else 0.0)
+        looked_up = self.descriptions + self.cache_hits
+        return {'descriptions': self.descriptions,
+                'cache_hits': self.cache_hits,
+                'cache_hit_rate': self.cache_hits / looked_up if looked_up else 0.0,
+                'timeouts': self.timeouts,
+                'seconds': self.seconds,
+                'patterns': patterns,
+                'histogram': {'edges': list(histogram_edges), 'counts': self.histogram},
+                'slowest': [{'seconds': seconds, 'sha1': digest, 'length': length}
+                            for seconds, digest, length in sorted(self.slowest, reverse=True)],
+                'top_n': self.top_n}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data.get('top_n', 20))
+        derived = ('mean_seconds', 'match_rate', 'hit_rate', 'share_of_time')
+        stats.patterns = {name: dict(_empty_pattern_counts, **{key: value for key, value in counts.items() if key not in derived})
+                          for name, counts in data['patterns'].items()}
+        stats.descriptions = data['descriptions']
+        stats.cache_hits = data.get('cache_hits', 0)
+        stats.timeouts = data.get('timeouts', 0)
+        stats.seconds = data['seconds']
+        stats.histogram = list(data['histogram']['counts'])
+        stats.slowest = [(row['seconds'], row['sha1'], row['length']) for row in data['slowest']]
+        heapq.heapify(stats.slowest)
+        return stats
+
+    def to_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -3,10 +3,13 @@
 # It also identifies jobs that offer zero hour contracts (likely hourly wage jobs), jobs that offer "competitive salaries and "negotiable" salaries
 ############################# 
 
+import re
+from collections import namedtuple
+from time import perf_counter
 
 
-#Clean raw salary
-#df['salary_raw_clean'] = df['salary_raw'].apply(lambda x: clean_description(x) if isinstance(x,str) else None)
+#Clean raw salary - clean_description and the batch version clean_descriptions are in description_cleaning.py
+#df['salary_raw_clean'] = clean_descriptions(df['salary_raw'])
 
 
 '''
@@ -305,26 +308,225 @@ competitive_negotiable_salary = r'''
 
 
 
-#hourly_wage_pattern = re.compile(hourly_wage, re.VERBOSE)
-#daily_wage_pattern = re.compile(daily_wage, re.VERBOSE)
-#weekly_wage_pattern = re.compile(weekly_wage, re.VERBOSE)
+'''
+Compiled patterns. Each pattern is compiled once when this file is imported and reused for every description.
+zero_hours, nat_liv_wage and min_wage are written on one line, so they are compiled without re.VERBOSE (VERBOSE would drop the literal space in e.g. "casual contract").
+'''
+zero_hours_pattern = re.compile(zero_hours)
+hourly_wage_pattern = re.compile(hourly_wage, re.VERBOSE)
+daily_wage_pattern = re.compile(daily_wage, re.VERBOSE)
+weekly_wage_pattern = re.compile(weekly_wage, re.VERBOSE)
 #monthly_wage_normal_values_pattern = re.compile(monthly_wage_normal_values)
 #monthly_wage_extreme_values_pattern = re.compile(monthly_wage_extreme_values)
-#annual_wage_pattern = re.compile(annual_wage, re.VERBOSE)
+annual_wage_pattern = re.compile(annual_wage, re.VERBOSE)
+competitive_negotiable_salary_pattern = re.compile(competitive_negotiable_salary, re.VERBOSE)
+nat_liv_wage_pattern = re.compile(nat_liv_wage)
+min_wage_pattern = re.compile(min_wage)
 
 
 
 # Make sure the regex code isnt case sensitive.
+# The monthly patterns are old and not used, so they are left out of the list.
+pay_freq_tuples_re = [('vacancy_with_zero_hour_contracts', zero_hours_pattern),
+                      ('vacancy_with_hourly_wage', hourly_wage_pattern),
+                      ('vacancy_with_daily_wage', daily_wage_pattern),
+                      ('vacancy_with_weekly_wage', weekly_wage_pattern),
+                      ('vacancy_with_annual_wage', annual_wage_pattern),
+                      ('vacancy_with_competitive_negotiable_salary', competitive_negotiable_salary_pattern),
+                      ('vacancy_with_national_living_wage', nat_liv_wage_pattern),
+                      ('vacancy_with_minimum_wage', min_wage_pattern)
+                      ]
+
+
+
 '''
-pay_freq_tuples_re = [('vacancy_with_zero_hour_contracts', zero_hours),
-                      ('vacancy_with_hourly_wage', hourly_wage), 
-                      ('vacancy_with_daily_wage', daily_wage), 
-                      ('vacancy_with_weekly_wage', weekly_wage),
-                      ('vacancy_with_monthly_wage_normal_values', monthly_wage_normal_values),
-                      ('vacancy_with_monthly_wage_extreme_values', monthly_wage_extreme_values),
-                      ('vacancy_with_annual_wage', annual_wage)
-                      ] 
+Keyword prefilter.
+Every pattern needs certain words (or a "£" sign) to be present before it can match. The lists below hold, for each pattern,
+groups of keywords: at least one keyword from EVERY group must appear in the description, otherwise the pattern cannot fire and is skipped.
+The keywords are taken from the pattern code above, so a change to a pattern needs a matching change here.
+'''
+pay_freq_keywords = {'vacancy_with_zero_hour_contracts': [('hour', 'casual contract', 'piece work')],
+                     'vacancy_with_hourly_wage': [('£',), ('hour', 'hr', 'ph', 'p.h', 'p/h', 'p\\h')],             # "hr" also covers "phr" and "p/hr"
+                     'vacancy_with_daily_wage': [('£',), ('day', 'dai', 'night', 'shift', 'pd', 'p.d', 'p/d', 'p\\d')], # "dai" for "daily" and "pd" for "pd"/"pday"
+                     'vacancy_with_weekly_wage': [('£',), ('week', 'pw', 'p.w', 'p/w', 'p\\w')],                      # "week" also covers "workweek"
+                     'vacancy_with_annual_wage': [('£', 'salar')],                                                     # Capture Groups 7 and 8 don't need a "£" sign but need "salar"
+                     'vacancy_with_competitive_negotiable_salary': [('salar',), ('competitive', 'negoti')],
+                     'vacancy_with_national_living_wage': [('national',), ('living',), ('wage',)],
+                     'vacancy_with_minimum_wage': [('minimum',), ('wage',)]
+                     }
+
+# Case insensitive regex code also matches these non-ASCII letters against "i", "s" and "k", so map them before lower-casing.
+_regex_case_folds = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's', 'K': 'k'})
+
+
+def prefilter_text(description):
+    '''
+    The description lower-cased the way the case insensitive patterns see it. translate() is slow, so it only runs when one of the letters in
+    _regex_case_folds is actually there.
+    '''
+    if not description.isascii() and any(letter in description for letter in 'İıſK'):
+        description = description.translate(_regex_case_folds)
+    return description.lower()
+
+
+def could_match(name, text, found=None):
+    '''
+    False when the keywords show the pattern cannot match. text is prefilter_text(description). Patterns without keywords are never skipped.
+    Keywords are only looked for until the answer is known: the groups are checked in order ("£" first), a group stops at its first keyword
+    present and the pattern stops at its first group with none. Pass the same dict as found for every pattern of a description so each keyword
+    is looked for at most once.
+    '''
+    if found is None:
+        found = {}
+    for group in pay_freq_keywords.get(name, ()):
+        for keyword in group:
+            present = found.get(keyword)
+            if present is None:
+                present = found[keyword] = keyword in text
+            if present:
+                break
+        else:
+            return False
+    return True
+
+
+
+'''
+Window-localised matching.
+hourly_wage, daily_wage and weekly_wage only match around a "£" sign: every match starts either at a "£" or at most 5 words before it (the
+"hour"/"day"/"week" word plus up to 4 words), and ends at most a dozen words after it. So instead of searching the whole description, the
+"£" signs are found with str.find and each pattern is only run on a window around them. The windows are passed to finditer() as pos/endpos, so
+nothing is copied, word boundaries still see the real characters either side, and the offsets are already offsets in the full description.
+annual_wage can only be windowed when "salar" is missing, because Capture Groups 7 and 8 don't need a "£" sign.
+
+Window bounds:
+- Start: the text just before a "£" that could belong to a match is only letters and at most 5 whitespace characters, so the window starts after
+  the 6th whitespace character or the first other character found going backwards.
+- End: after the "£" a match only uses letters, digits, whitespace, "£" and the characters , . - / and backslash, with at most 9 runs of whitespace (range words, hour words and
+  lookaheads included). The window stops at the 13th run of whitespace or the first other character, plus one character for word boundaries and lookaheads.
+Overlapping windows are merged so that finditer() sees the same text, in the same order, as a whole-text scan and returns identical hits.
+
+Every character is looked at a bounded number of times, so finding the windows is linear in the length of the description:
+- Going backwards stops at the end of the previous window, since anything before it is merged anyway.
+- Going forwards starts where the previous forward scan stopped when the "£" is inside it. The whitespace runs are then counted from there
+  rather than from the "£", so the window can come out a little longer than needed, which never changes the hits.
+- A window longer than max_window characters (e.g. a long run of "£" signs, or a very long word before one) makes pound_windows() give up and
+  return None, and the caller scans the whole description instead.
+'''
+pay_freq_pound_anchored = {'vacancy_with_hourly_wage': None,
+                           'vacancy_with_daily_wage': None,
+                           'vacancy_with_weekly_wage': None,
+                           'vacancy_with_annual_wage': 'salar'   # Only windowed when this keyword is missing
+                           }
+
+_window_after_pound = re.compile(r'(?:[\w,.\-/\\£]*\s+){0,12}[\w,.\-/\\£]*')
+
+
+def pound_windows(description, max_window=2048):
+    '''
+    List of merged (start, end) windows around every "£" sign in the description, or None when a window would be longer than max_window.
+    '''
+    windows = []
+    scanned = 0                                     # End of the last forward scan
+    pound = description.find('£')
+    while pound != -1:
+        # Back over at most 5 whitespace characters and the letters ([^\W\d_]) between them
+        floor = max(windows[-1][1] if windows else 0, pound - max_window - 1)
+        start, spaces = pound, 0
+        while start > floor:
+            c = description[start - 1]
+            if c.isspace():
+                if spaces == 5:
+                    break
+                spaces += 1
+            elif not c.isalnum() or c.isdecimal():
+                break
+            start -= 1
+        if pound - start > max_window:
+            return None
+
+        scan_from = max(pound + 1, scanned)
+        scanned = _window_after_pound.match(description, scan_from, scan_from + max_window + 1).end()
+        end = min(len(description), scanned + 1)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+        if windows[-1][1] - windows[-1][0] > max_window:
+            return None
+        pound = description.find('£', pound + 1)
+    return windows
+
+
+
+'''
+Extract every pay frequency from a description in one call.
+Returns a dict with one entry per pattern in pay_freq_tuples_re. Each entry is a list of hits, and each hit holds the capture groups and the start/end offsets of the match in the description.
+Descriptions that are not strings (e.g. missing values) give an empty list for every pattern.
+With prefilter=True a pattern is only run when could_match() says it can fire. Pass a collections.Counter as skip_counts to count how often each pattern was skipped.
+With windowed=True the patterns in pay_freq_pound_anchored are only run on the windows from pound_windows(). The hits are identical to a whole-text scan.
+
+iter_pay_frequency_matches() does the same scan but yields the re.Match objects as they are found, for batch code that doesn't want to keep a Hit per match.
+Pass a salary_extraction_stats.ExtractionStats as stats to time every pattern and description. Without it nothing is timed.
+
+The patterns are kept as separate regexes rather than merged into one big alternation: a merged regex only returns one match per position,
+so an hourly hit could hide an overlapping daily or annual hit and the results would no longer match running each pattern on its own.
 '''
+Hit = namedtuple('Hit', ['groups', 'start', 'end'])
+
+
+def iter_pay_frequency_matches(description, patterns=pay_freq_tuples_re, prefilter=True, skip_counts=None, windowed=False, stats=None):
+    if not isinstance(description, str):
+        for name, pattern in patterns:
+            yield name, ()
+        return
+
+    if stats is not None:
+        started = perf_counter()
+    text = prefilter_text(description) if prefilter or windowed else None
+    found = {}
+    if stats is not None:
+        spent = perf_counter() - started             # Time spent in this function only, not in the code consuming the matches
+    windows = None
+    for name, pattern in patterns:
+        if prefilter and not could_match(name, text, found):
+            if skip_counts is not None:
+                skip_counts[name] += 1
+            if stats is not None:
+                stats.record_skip(name)
+            yield name, ()
+            continue
+
+        if stats is not None:
+            started = perf_counter()
+        if windowed and name in pay_freq_pound_anchored and (pay_freq_pound_anchored[name] is None or pay_freq_pound_anchored[name] not in text):
+            if windows is None:
+                windows = pound_windows(description)
+                if windows is None:                 # A window too long to be worth it - scan the whole description
+                    windows = [(0, len(description))]
+            matches = (m for start, end in windows for m in pattern.finditer(description, start, end))
+        else:
+            matches = pattern.finditer(description)
+
+        if stats is not None:
+            try:
+                matches = list(matches)
+            except Exception:
+                # Only a time budget stops a pattern part way: the time it ran for still goes to it
+                stats.record_pattern_timeout(name, perf_counter() - started)
+                raise
+            elapsed = perf_counter() - started
+            spent += elapsed
+            stats.record_pattern(name, elapsed, len(matches))
+        yield name, matches
+
+    if stats is not None:
+        stats.record_description(description, spent)
+
+
+def extract_pay_frequencies(description, patterns=pay_freq_tuples_re, prefilter=True, skip_counts=None, windowed=False, stats=None):
+    return {name: [Hit(m.groups(), m.start(), m.end()) for m in matches]
+            for name, matches in iter_pay_frequency_matches(description, patterns, prefilter, skip_counts, windowed, stats)}
 
 
 
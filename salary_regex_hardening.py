@@ -0,0 +1,371 @@
+#############################
+# Hardened execution of the salary patterns for badly scraped or adversarial descriptions.
+# 1) A per-description time budget: a description that takes too long is marked as timed out instead of stalling the worker.
+# 2) An optional RE2 backend (google-re2). Patterns without lookarounds run on RE2 outright. The hourly, daily, weekly and annual patterns
+#    (lookarounds and nested quantifiers) use RE2 to find candidate positions and the reference regex only confirms each one. Cross-checked
+#    against the reference regex code.
+# 3) A generated corpus of pathological inputs and a report of how each pattern's run time grows on them.
+#
+# Usage: python salary_regex_hardening.py     (prints the worst-case report)
+#############################
+
+import re
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import re2                                         # pip install google-re2 - optional
+except ImportError:
+    re2 = None
+
+from salary_regex_code_for_description_var import extract_pay_frequencies, pay_freq_tuples_re
+
+
+'''
+Time budget.
+The re module checks for signals while it matches, so a SIGALRM timer can stop a pattern that is backtracking for too long.
+Timers only work in the main thread on Unix (which is where the process pool workers run the extraction). Elsewhere the budget is not enforced.
+Python's re has no step counter, so the budget is a time budget.
+'''
+class DescriptionTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise DescriptionTimeout()
+
+
+@contextmanager
+def time_budget(seconds):
+    '''
+    Raise DescriptionTimeout inside the with block once it has run for more than seconds. A budget of None or 0 means no limit.
+    '''
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_with_budget(description, budget=1.0, **kwargs):
+    '''
+    extract_pay_frequencies() with a time budget in seconds. Returns (result, timed_out); result is None when the description timed out.
+    '''
+    try:
+        with time_budget(budget):
+            return extract_pay_frequencies(description, **kwargs), False
+    except DescriptionTimeout:
+        return None, True
+
+
+'''
+Linear-time backend.
+RE2 runs in linear time but has no lookarounds, so only the patterns without them (zero_hours, competitive_negotiable_salary, nat_liv_wage and
+min_wage) can run on it as they are. RE2 also has no VERBOSE mode, so the comments and layout whitespace are stripped first.
+The hourly, daily, weekly and annual patterns are the ones with lookarounds and nested quantifiers. For them RE2 runs a candidate pattern: the
+same pattern with the lookarounds dropped. Dropping a lookaround only removes a condition, so the candidate pattern matches at every position
+where the reference pattern does (and at some where it doesn't). RE2 finds the next such position and the reference pattern is tried at that
+one position with match(). It is never search()ed across the text, so the text between candidates is only read by RE2.
+RE2's whitespace class, digits, word boundaries and case folding are ASCII-only where Python's are Unicode. The lookaround-free patterns are
+only used for descriptions that are pure ASCII, with the whitespace class spelled out as the ASCII characters Python treats as whitespace.
+Candidate patterns must also work on text with a "£" sign, so they spell out Python's Unicode whitespace and digit classes and drop the word
+boundaries (again only removing a condition). The only non-ASCII letters Python's case folding matches against ASCII letters are the ones in
+_case_fold_letters, and descriptions with those go to the reference regex code.
+'''
+_lookarounds = ('(?=', '(?!', '(?<=', '(?<!')
+_python_ascii_whitespace = r'\t\n\x0b\f\r\x1c-\x1f '
+_python_unicode_whitespace = ''.join(f'\\x{{{cp:x}}}' for cp in range(0x3001) if chr(cp).isspace())
+_case_fold_letters = 'İıſK'
+
+
+def strip_verbose(pattern):
+    '''
+    Remove the whitespace and "#" comments that re.VERBOSE ignores (outside character classes and escapes).
+    '''
+    out = []
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if ch == ']' and not (out[-1] == '[' or out[-1] == '[^'):
+                in_class = False
+            out.append(ch)
+        elif ch == '[':
+            in_class = True
+            if pattern[i + 1:i + 2] == '^':
+                ch, i = '[^', i + 1
+            out.append(ch)
+        elif ch == '#':
+            while i < len(pattern) and pattern[i] != '\n':
+                i += 1
+            continue
+        elif not ch.isspace():
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def _class_end(source, i):
+    '''
+    Index just after the character class starting at source[i] ("["). A "]" straight after "[" or "[^" is a literal.
+    '''
+    j = i + 1
+    if source[j:j + 1] == '^':
+        j += 1
+    if source[j:j + 1] == ']':
+        j += 1
+    while source[j] != ']':
+        j += 2 if source[j] == '\\' else 1
+    return j + 1
+
+
+def strip_lookarounds(source):
+    '''
+    Remove every lookahead and lookbehind group from a (non-VERBOSE) pattern string.
+    '''
+    out = []
+    i = 0
+    while i < len(source):
+        if source.startswith(_lookarounds, i):
+            depth = 0
+            while True:                                 # Skip to the parenthesis closing the lookaround
+                ch = source[i]
+                if ch == '\\':
+                    i += 2
+                    continue
+                if ch == '[':
+                    i = _class_end(source, i)
+                    continue
+                if ch == '(':
+                    depth += 1
+                elif ch == ')':
+                    depth -= 1
+                i += 1
+                if depth == 0:
+                    break
+        elif source[i] == '\\':
+            out.append(source[i:i + 2])
+            i += 2
+        elif source[i] == '[':                          # Copy character classes whole, so a "(" inside one isn't read as a group
+            end = _class_end(source, i)
+            out.append(source[i:end])
+            i = end
+        else:
+            out.append(source[i])
+            i += 1
+    return ''.join(out)
+
+
+def linear_time_compatible(pattern):
+    return not any(lookaround in pattern.pattern for lookaround in _lookarounds)
+
+
+def to_re2_syntax(pattern, candidate=False):
+    '''
+    RE2 version of a compiled reference pattern: VERBOSE layout stripped and the whitespace class replaced by Python's ASCII whitespace characters.
+    With candidate=True it is the candidate pattern instead: lookarounds and word boundaries dropped, and Python's Unicode whitespace and digit
+    classes spelled out.
+    '''
+    source = strip_verbose(pattern.pattern) if pattern.flags & re.VERBOSE else pattern.pattern
+    whitespace = _python_ascii_whitespace
+    if candidate:
+        source = strip_lookarounds(source)
+        whitespace = _python_unicode_whitespace
+    out = []
+    i = 0
+    in_class = False
+    while i < len(source):
+        ch = source[i]
+        if source.startswith('\\s', i):
+            out.append(whitespace if in_class else '[' + whitespace + ']')
+            i += 2
+            continue
+        if candidate and source.startswith('\\d', i):
+            out.append('\\p{Nd}')
+            i += 2
+            continue
+        if candidate and source.startswith('\\b', i) and not in_class:
+            i += 2
+            continue
+        if ch == '\\':
+            out.append(source[i:i + 2])
+            i += 2
+            continue
+        if ch == '[' and not in_class:
+            in_class = True
+        elif ch == ']' and in_class and out[-1] not in ('[', '^'):
+            in_class = False
+        out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+class LinearTimePattern:
+    '''
+    Drop-in stand-in for a compiled reference pattern that runs RE2 on ASCII descriptions and the reference pattern on everything else.
+    pattern and flags are the reference pattern's, so cache fingerprints don't change.
+    '''
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.pattern = reference.pattern
+        self.flags = reference.flags
+        self.linear = re2.compile(to_re2_syntax(reference))
+
+    def finditer(self, description, pos=0, endpos=None):
+        if description.isascii():
+            return self.linear.finditer(description, pos, len(description) if endpos is None else endpos)
+        return self.reference.finditer(description, pos, len(description) if endpos is None else endpos)
+
+
+class CandidatePattern:
+    '''
+    Drop-in stand-in for a compiled reference pattern with lookarounds. RE2 finds the candidate positions and the reference pattern is only tried
+    at those, which gives the same matches as the reference finditer(). Descriptions with a letter from _case_fold_letters go to the reference.
+    pattern and flags are the reference pattern's, so cache fingerprints don't change.
+    '''
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.pattern = reference.pattern
+        self.flags = reference.flags
+        self.candidates = re2.compile(to_re2_syntax(reference, candidate=True))
+
+    def finditer(self, description, pos=0, endpos=None):
+        endpos = len(description) if endpos is None else min(endpos, len(description))
+        if not description.isascii() and any(letter in description for letter in _case_fold_letters):
+            return self.reference.finditer(description, pos, endpos)
+        return self._finditer(description, pos, endpos)
+
+    def _finditer(self, description, pos, endpos):
+        # RE2 gets the text between pos and endpos as UTF-8 bytes, once: its str interface encodes the whole text again on every call.
+        # The candidate pattern doesn't look behind, so nothing before pos is needed. Offsets only move forwards, so byte offsets are converted
+        # to character offsets (and back) one stretch at a time.
+        text = description[pos:endpos].encode('utf-8')
+        ascii = len(text) == endpos - pos
+        byte, char = 0, pos
+        while True:
+            candidate = self.candidates.search(text, byte)
+            if candidate is None:
+                return
+            start = candidate.start()
+            char += start - byte if ascii else len(text[byte:start].decode('utf-8'))
+            byte = start
+            m = self.reference.match(description, char, endpos)
+            if m is None:
+                following = char + 1
+            else:
+                yield m
+                following = m.end() if m.end() > char else m.end() + 1
+            if following > endpos:
+                return
+            byte += following - char if ascii else len(description[char:following].encode('utf-8'))
+            char = following
+
+
+def linear_time_patterns(patterns=pay_freq_tuples_re):
+    '''
+    Copy of the pattern list with the lookaround-free patterns swapped for LinearTimePattern and the others for CandidatePattern.
+    Without google-re2 the list is returned as it is. Use it as extract_pay_frequencies(description, patterns=linear_time_patterns()).
+    '''
+    if re2 is None:
+        return list(patterns)
+    return [(name, LinearTimePattern(pattern) if linear_time_compatible(pattern) else CandidatePattern(pattern)) for name, pattern in patterns]
+
+
+def cross_check(descriptions, patterns=pay_freq_tuples_re):
+    '''
+    Run the reference and the linear-time patterns on every description and return (row, pattern name) for each difference in hits.
+    '''
+    linear = linear_time_patterns(patterns)
+    differences = []
+    for i, description in enumerate(descriptions):
+        expected = extract_pay_frequencies(description, patterns, prefilter=False)
+        found = extract_pay_frequencies(description, linear, prefilter=False)
+        differences.extend((i, name) for name in expected if expected[name] != found[name])
+    return differences
+
+
+'''
+Pathological inputs.
+Families of generated text aimed at the nested quantifiers: long runs of short words, repeated "£" figures with no hour/day/week word, hour and
+salary words followed by many words, long words, long whitespace runs and range separators. The "£" runs and the long word before a "£" are
+also aimed at pound_windows(). Each family is generated at several lengths so the report shows how run time grows with length for every
+pattern, and for the windowed scan of all the patterns together.
+'''
+pathological_families = {'short_words': lambda n: 'a ' * (n // 2),
+                         'long_word': lambda n: 'a' * n,
+                         'hour_then_long_word': lambda n: 'hour' + 'a' * n,
+                         'repeated_pound_figures': lambda n: '£10 ' * (n // 4),
+                         'pound_figures_no_spaces': lambda n: '£1,' * (n // 3),
+                         'pound_then_whitespace': lambda n: '£10' + ' ' * n + 'x',
+                         'pound_signs': lambda n: '£' * n,
+                         'pound_letter_pairs': lambda n: '£a' * (n // 2),
+                         'long_word_then_pound': lambda n: 'a' * n + '£10 per hour',
+                         'pound_range_separators': lambda n: '£10 ' + '- ' * (n // 2),
+                         'hour_words': lambda n: 'hour ' * (n // 5),
+                         'day_words': lambda n: 'day ' * (n // 4),
+                         'week_words': lambda n: 'week ' * (n // 5),
+                         'salary_words': lambda n: 'salary ' * (n // 7),
+                         'salary_short_words': lambda n: 'salary a b ' * (n // 11),
+                         'k_figures': lambda n: 'salary 50k ' * (n // 11),
+                         'digits': lambda n: '1' * n,
+                         'mixed_case_words': lambda n: 'Per HOUR Day Week ' * (n // 18)
+                         }
+
+
+def pathological_inputs(sizes=(1000, 4000, 16000, 64000)):
+    '''
+    Yield (family, size, text) for every family at every size.
+    '''
+    for family, generate in pathological_families.items():
+        for size in sizes:
+            yield family, size, generate(size)
+
+
+def worst_case_report(patterns=pay_freq_tuples_re, sizes=(1000, 4000, 16000, 64000), repeat=3):
+    '''
+    Time every pattern on every pathological input. Returns rows of (family, pattern name, {size: seconds}, growth), worst first.
+    The rows named "windowed" time extract_pay_frequencies(windowed=True) with all the patterns, window search included.
+    growth is the exponent k in time ~ size**k between the smallest and largest size: about 1 is linear, 2 or more means backtracking.
+    '''
+    import math
+
+    scans = [(name, pattern.finditer) for name, pattern in patterns]
+    scans.append(('windowed', lambda text: extract_pay_frequencies(text, patterns, prefilter=False, windowed=True).values()))
+    timings = {}
+    for family, size, text in pathological_inputs(sizes):
+        for name, scan in scans:
+            best = math.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for m in scan(text):
+                    pass
+                best = min(best, time.perf_counter() - start)
+            timings.setdefault((family, name), {})[size] = best
+
+    rows = []
+    for (family, name), by_size in timings.items():
+        small, large = min(by_size), max(by_size)
+        growth = math.log(max(by_size[large], 1e-9) / max(by_size[small], 1e-9)) / math.log(large / small)
+        rows.append((family, name, by_size, growth))
+    return sorted(rows, key=lambda row: row[2][max(row[2])], reverse=True)
+
+
+if __name__ == '__main__':
+    for family, name, by_size, growth in worst_case_report():
+        times = '  '.join(f'{size}: {seconds * 1000:8.2f}ms' for size, seconds in sorted(by_size.items()))
+        print(f'{family:24} {name:44} {times}  growth {growth:.2f}')
@@ -0,0 +1,185 @@
+#############################
+# Cache of extraction results keyed by the description text, so re-posted adverts and overlapping monthly dumps aren't scanned again.
+# An in-memory LRU sits in front of an on-disk SQLite store. Both are size bounded.
+#############################
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from salary_regex_code_for_description_var import Hit, extract_pay_frequencies, pay_freq_tuples_re
+
+
+def pattern_fingerprint(patterns=pay_freq_tuples_re):
+    '''
+    Version fingerprint of a pattern set. It changes whenever a pattern name, pattern string or flag is edited, which makes every result cached
+    with the old patterns stale. The prefilter and window stages give identical results, so they are not part of the fingerprint.
+    '''
+    digest = hashlib.sha256()
+    for name, pattern in patterns:
+        digest.update(json.dumps([name, pattern.pattern, pattern.flags]).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def normalise_for_cache(description):
+    '''
+    Text used for the cache key and the offset to add to cached offsets.
+    Leading and trailing whitespace are dropped: no pattern starts or ends a match with whitespace, and whitespace and the ends of the text look
+    the same to word boundaries and to the lookaheads, so the hits are the same apart from the offset shift.
+    '''
+    stripped = description.lstrip()
+    return stripped.rstrip(), len(description) - len(stripped)
+
+
+class SalaryResultCache:
+    '''
+    Extraction results keyed by a hash of the normalised description and the pattern fingerprint.
+
+    memory_items bounds the in-memory LRU and disk_items the number of rows kept on disk (the least recently used rows are evicted first).
+    Results cached with a different pattern fingerprint are deleted when the cache is opened.
+    Use extract() in place of extract_pay_frequencies(); stats holds the memory hit, disk hit, miss and eviction counts.
+
+    Several worker processes can share one file. New results and last-used times (of memory and disk hits alike) are buffered and written in
+    one short transaction every commit_every results, so a worker never holds the write lock while it scans descriptions. The row count is kept
+    in the file and updated in the same transaction, so disk_items bounds the shared store rather than each worker's share of it.
+    '''
+
+    def __init__(self, path, patterns=pay_freq_tuples_re, memory_items=100000, disk_items=10000000, commit_every=1000):
+        self.patterns = patterns
+        self.fingerprint = pattern_fingerprint(patterns)
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.commit_every = commit_every
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self._memory = OrderedDict()
+        self._new = {}                                  # Key -> (result JSON, last used) not written yet
+        self._touched = {}                              # Key -> last used time not written yet
+
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)    # Transactions are opened explicitly by _transaction()
+        self._db.execute('PRAGMA journal_mode=WAL')   # Lets several worker processes share the file
+        with self._transaction():
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, fingerprint TEXT, result TEXT, last_used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)')
+            # Only the first worker to open the file with new patterns pays for the stale row scan and the row count
+            if self._meta('fingerprint') != self.fingerprint or self._meta('rows') is None:
+                self._db.execute('DELETE FROM results WHERE fingerprint != ?', (self.fingerprint,))
+                self._set_meta('fingerprint', self.fingerprint)
+                self._set_meta('rows', self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute('BEGIN IMMEDIATE')           # Take the write lock up front rather than failing to upgrade a read lock
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def _meta(self, name):
+        row = self._db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, name, value):
+        self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value))
+
+    def _key(self, text):
+        return hashlib.sha256((self.fingerprint + '\0' + text).encode('utf-8')).digest()[:16]
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _commit_if_due(self):
+        if len(self._new) + len(self._touched) >= self.commit_every:
+            self.commit()
+
+    def get(self, description):
+        '''
+        Cached result for the description, or None.
+        '''
+        text, offset = normalise_for_cache(description)
+        key = self._key(text)
+        result = self._memory.get(key)
+        if result is not None:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+        else:
+            row = self._new.get(key) or self._db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            result = json.loads(row[0])
+            self._remember(key, result)
+            self.stats['disk_hits'] += 1
+        self._touched[key] = time.time()
+        self._commit_if_due()
+        return _from_cached(result, offset, self.patterns)
+
+    def put(self, description, result):
+        text, offset = normalise_for_cache(description)
+        key = self._key(text)
+        cached = _to_cached(result, offset)
+        self._remember(key, cached)
+        self._new[key] = (json.dumps(cached, separators=(',', ':')), time.time())
+        self._commit_if_due()
+
+    def extract(self, description, stats=None, **kwargs):
+        '''
+        extract_pay_frequencies() through the cache. Keyword arguments are passed on to extract_pay_frequencies() on a miss.
+        With an ExtractionStats as stats, a miss is timed as usual and a hit is counted with record_cache_hit().
+        '''
+        if not isinstance(description, str):
+            return extract_pay_frequencies(description, self.patterns, stats=stats)
+        result = self.get(description)
+        if result is None:
+            result = extract_pay_frequencies(description, self.patterns, stats=stats, **kwargs)
+            self.put(description, result)
+        elif stats is not None:
+            stats.record_cache_hit()
+        return result
+
+    def commit(self):
+        '''
+        Write buffered results and last-used times to disk and evict the least recently used rows if the store is over disk_items.
+        '''
+        if not self._new and not self._touched:
+            return
+        with self._transaction():
+            inserted = self._db.executemany('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)',
+                                            [(key, self.fingerprint, result, last_used) for key, (result, last_used) in self._new.items()]).rowcount
+            self._db.executemany('UPDATE results SET last_used = ? WHERE key = ?', [(t, k) for k, t in self._touched.items()])
+            rows = self._meta('rows') + inserted        # Read inside the transaction, so other workers' rows are counted too
+            if rows > self.disk_items:
+                excess = rows - self.disk_items + self.disk_items // 10    # Evict an extra 10% so this doesn't run on every commit
+                evicted = self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)', (excess,)).rowcount
+                rows -= evicted
+                self.stats['evictions'] += evicted
+            self._set_meta('rows', rows)
+        self._new.clear()
+        self._touched.clear()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+
+def _to_cached(result, offset):
+    # Only patterns with hits are stored, with offsets relative to the normalised text.
+    return {name: [[list(hit.groups), hit.start - offset, hit.end - offset] for hit in hits] for name, hits in result.items() if hits}
+
+
+def _from_cached(cached, offset, patterns):
+    return {name: [Hit(tuple(groups), start + offset, end + offset) for groups, start, end in cached.get(name, ())] for name, pattern in patterns}